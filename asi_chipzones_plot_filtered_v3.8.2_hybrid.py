@@ -50,11 +50,11 @@ plt.rcParams["axes.unicode_minus"] = False
 def delete_all_files(symbol):
     save_dir = f"docs/{symbol}"
     os.makedirs(save_dir, exist_ok=True)
-    for file in os.listdir(save_dir):
-        file_path = os.path.join(save_dir, file)
-        if os.path.isfile(file_path):
-            os.remove(file_path)
-            print(f"[INFO] 删除文件：{file_path}")
+    with os.scandir(save_dir) as it:
+        for entry in it:
+            if entry.is_file():
+                os.remove(entry.path)
+                print(f"[INFO] 删除文件：{entry.path}")
 
 
 # =============================
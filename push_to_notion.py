@@ -1,10 +1,24 @@
 import os
 import csv
+import time
+import random
+import functools
+import importlib.util
+import threading
+import httpx
 import yaml
 from notion_client import Client
-import glob
+from notion_client.errors import HTTPResponseError, RequestTimeoutError
+from notion_client.helpers import iterate_paginated_api
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml
+except ImportError:
+    from yaml import SafeLoader
+
 # -------------------------------------------
 # 🔥 固定使用 jsDelivr CDN
 # -------------------------------------------
@@ -13,8 +27,103 @@ NOTION_DB = os.getenv("NOTION_DB")
 NOTION_PARENT_PAGE = os.getenv("NOTION_PARENT_PAGE")
 
 PAGES_BASE = "https://cdn.jsdelivr.net/gh/CMUJIN/trading@main/docs"
+ASSET_URL_TPL = PAGES_BASE + "/{code}/{name}"
+
+# 所有请求共用一个 keep-alive 连接池，避免重复 TLS 握手；装了 h2 时走 HTTP/2 多路复用
+_http = httpx.Client(
+    http2=importlib.util.find_spec("h2") is not None,
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+)
+notion = Client(auth=NOTION_TOKEN, client=_http)
+
+# Notion 限流约 3 req/s：令牌桶 2.5 req/s（突发 5），失败时退避重试
+RATE_PER_SEC = 2.5
+RATE_BURST = 5
+MAX_RETRIES = 6
+# 429 限流；409 为同一父块并发写入冲突（并发删除时可能出现）；5xx 为网关/服务端瞬时错误
+RETRY_STATUSES = (409, 429, 500, 502, 503, 504)
+# append 非幂等：502/504 时该批可能已写入，盲目重试会重复追加，故只重试未执行的 409/429
+APPEND_RETRY_STATUSES = (409, 429)
+
+# blocks.children.append 单次最多 100 个子块
+APPEND_BATCH = 100
+DELETE_WORKERS = 3
+
+# 本地文件扫描 / 读取的线程数
+IO_WORKERS = 16
+
+# 目录页 CSV 代码块预览长度（Notion 单段 rich_text 上限 2000）
+CSV_PREVIEW_CHARS = 1800
 
-notion = Client(auth=NOTION_TOKEN)
+# 每个品种的本地文件信息（只解析/检查一次，main 与目录构建共用）
+# *_mtime 为 None 表示文件不存在
+SymRec = namedtuple("SymRec", "code csv_path img_path trend_path csv_mtime img_mtime")
+
+
+# -----------------------------
+# 限流 + 429 重试
+# -----------------------------
+class Limiter:
+    """线程安全的令牌桶"""
+
+    def __init__(self, rate=RATE_PER_SEC, burst=RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+limiter = Limiter()
+
+
+def retry_after_seconds(e):
+    """Retry-After 为秒数时返回该值；HTTP-date 形式或缺失时返回 0（退回 2^n 退避）"""
+    try:
+        return float(e.headers.get("retry-after") or 0)
+    except ValueError:
+        return 0
+
+
+def rate_limited(fn, retry_statuses=RETRY_STATUSES, retry_timeout=True):
+    """
+    每次调用先取令牌；可重试状态按 Retry-After / 2^n（上限 60s）加抖动等待后重试。
+    retry_timeout 只对幂等调用开启：超时的请求可能已在服务端生效。
+    """
+    @functools.wraps(fn)
+    def wrapped(*args, **kwargs):
+        for attempt in range(MAX_RETRIES + 1):
+            limiter.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except HTTPResponseError as e:  # 含 APIResponseError；5xx 的 HTML 错误页也在此列
+                if e.status not in retry_statuses or attempt == MAX_RETRIES:
+                    raise
+                delay = min(max(retry_after_seconds(e), 2 ** attempt), 60)
+                time.sleep(delay + random.random() * 0.25)  # 抖动，避免并发线程同时重试
+            except RequestTimeoutError:
+                if not retry_timeout or attempt == MAX_RETRIES:
+                    raise
+                time.sleep(min(2 ** attempt, 60) + random.random() * 0.25)
+    return wrapped
+
+
+notion.blocks.children.list = rate_limited(notion.blocks.children.list)
+notion.blocks.children.append = rate_limited(notion.blocks.children.append, APPEND_RETRY_STATUSES,
+                                              retry_timeout=False)
+notion.blocks.delete = rate_limited(notion.blocks.delete)
 
 
 # -----------------------------
@@ -28,40 +137,170 @@ def safe_text_block(content, block_type="heading_2"):
     }
 
 
-def get_latest_image(pattern):
-    """自动匹配: *_YYYYMMDD_HH.png"""
-    files = glob.glob(pattern)
-    if not files:
+def image_block(url):
+    return {
+        "object": "block",
+        "type": "image",
+        "image": {"type": "external", "external": {"url": url}},
+    }
+
+
+def chunked(seq, n):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+
+def asset_url(code, path):
+    """docs/<code>/<file> → CDN 链接；path 为 None 时返回 None"""
+    if not path:
         return None
-    return max(files, key=os.path.getmtime)
+    return ASSET_URL_TPL.format(code=code, name=os.path.basename(path))
+
+
+def read_csv_preview(csv_path, n=CSV_PREVIEW_CHARS):
+    """只读取代码块需要的前 n 个字符"""
+    with open(csv_path, "r", encoding="utf-8-sig") as f:
+        return f.read(n)
+
+
+def scan_symbol_dir(code):
+    """
+    一次 scandir 遍历 docs/<code>/，同时找出 CSV 与最新的 chipzones / trend_v6 图
+    （自动匹配 *_YYYYMMDD_HH.png）。返回 {"csv"|"chip"|"trend": (path, mtime)}，
+    缺失时为 (None, None)；mtime 来自 DirEntry.stat()，后续不再重复 stat。
+    """
+    csv_name = f"{code}_chipzones_hybrid.csv"
+    prefixes = {"chip": f"{code}_chipzones_hybrid", "trend": f"{code}_trend_v6"}
+    found = {"csv": (None, None), "chip": (None, None), "trend": (None, None)}
+    try:
+        with os.scandir(f"docs/{code}") as it:
+            for e in it:
+                if not e.is_file():
+                    continue
+                name = e.name
+                if name == csv_name:
+                    found["csv"] = (e.path, e.stat().st_mtime)
+                    continue
+                if not name.endswith(".png"):
+                    continue
+                for kind, prefix in prefixes.items():
+                    if name.startswith(prefix):
+                        mtime = e.stat().st_mtime
+                        if found[kind][1] is None or mtime > found[kind][1]:
+                            found[kind] = (e.path, mtime)
+                        break
+    except FileNotFoundError:
+        pass
+    return found
 
 
 # -----------------------------
 # 清空目录页
 # -----------------------------
-def clear_directory(directory_id):
+def clear_directory(directory_id, children):
+    """
+    边翻页边比对：与 children 相同的前缀保留，之后的旧块一经列出即提交并发删除，
+    删除与后续翻页重叠进行。child_page / child_database 不参与比对、不删除。
+    返回保留的块数；任何一页列出或删除失败都直接抛出（不返回部分前缀），
+    否则未列出的旧块会留在页面上，追加后内容重复。
+    """
+    wanted = [block_signature(b) for b in children]
+    keep = 0
+    diverged = False
+    futures = []
     try:
-        children = notion.blocks.children.list(directory_id)["results"]
-        cleared = 0
-        for child in children:
-            if child["type"] in ("child_page", "child_database"):
-                print(f"[SAFE MODE] ⚠️ Skipped deleting {child['type']} block ({child['id']})")
-                continue
-            notion.blocks.delete(child["id"])
-            cleared += 1
-        print(f"[push_to_notion] 🧹 Cleared {cleared} blocks.")
+        # 并发删除（节奏由 limiter 控制）；SDK 自带游标翻页（单页最多 100）
+        with ThreadPoolExecutor(max_workers=DELETE_WORKERS) as ex:
+            try:
+                for child in iterate_paginated_api(notion.blocks.children.list,
+                                                   block_id=directory_id, page_size=100):
+                    if child["type"] in ("child_page", "child_database"):
+                        print(f"[SAFE MODE] ⚠️ Skipped deleting {child['type']} block ({child['id']})")
+                        continue
+                    if not diverged and keep < len(wanted) and block_signature(child) == wanted[keep]:
+                        keep += 1
+                        continue
+                    diverged = True
+                    futures.append(ex.submit(notion.blocks.delete, child["id"]))
+                for fut in futures:
+                    fut.result()
+            except Exception:
+                ex.shutdown(cancel_futures=True)  # 尚未发出的删除不再执行
+                raise
     except Exception as e:
         print(f"[WARN] Failed to clear directory: {e}")
+        raise
+    if futures:
+        print(f"[push_to_notion] 🧹 Cleared {len(futures)} blocks.")
+    return keep
+
+
+def block_signature(block):
+    """块的可比内容：本地构建的块与 Notion 返回的块得到相同签名"""
+    btype = block["type"]
+    body = block.get(btype, {})
+    if btype == "image":
+        return btype, body.get("external", {}).get("url")
+    return btype, tuple(rt.get("text", {}).get("content") for rt in body.get("rich_text", []))
 
 
 # -----------------------------
 # 获取文件更新时间
 # -----------------------------
-def get_file_update_time(path):
-    if not path or not os.path.exists(path):
+def get_file_update_time(mtime):
+    """mtime 由 _resolve_symbols 一次 stat 得到；None 表示文件不存在"""
+    if mtime is None:
         return "❌ 文件不存在"
-    ts = os.path.getmtime(path)
-    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+    return datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# -----------------------------
+# 单个品种的目录块（纯本地 I/O + 拼装，可并行）
+# -----------------------------
+def build_symbol_blocks(rec):
+    code = rec.code
+    csv_path = rec.csv_path
+    blocks = []
+
+    # ===== 最新 chipzones / trend_v6 图 =====
+    img_url = asset_url(code, rec.img_path)
+    trend_url = asset_url(code, rec.trend_path)
+
+    # 更新时间
+    csv_time = get_file_update_time(rec.csv_mtime)
+    img_time = get_file_update_time(rec.img_mtime)
+
+    # ===== 写入内容 =====
+    blocks.append(safe_text_block(f"📊 {code} Analysis"))
+    blocks.append(safe_text_block(f"📅 Last Updated: CSV={csv_time} | IMG={img_time}", "paragraph"))
+
+    # ===== trend_v6 图 =====
+    if trend_url:
+        blocks.append(image_block(trend_url))
+    else:
+        blocks.append(safe_text_block(f"⚠️ Trend_v6 image not found for {code}", "paragraph"))
+
+    # ===== chipzones 图 =====
+    if img_url:
+        blocks.append(image_block(img_url))
+    else:
+        blocks.append(safe_text_block(f"⚠️ Chipzones image not found for {code}", "paragraph"))
+
+    # ===== CSV 展示（不变）=====
+    if rec.csv_mtime is not None:
+        csv_text = read_csv_preview(csv_path)
+        blocks.append({
+            "object": "block",
+            "type": "code",
+            "code": {
+                "language": "markdown",
+                "rich_text": [{"type": "text", "text": {"content": csv_text}}],
+            },
+        })
+    else:
+        blocks.append(safe_text_block(f"⚠️ CSV not found for {code}", "paragraph"))
+
+    return blocks
 
 
 # -----------------------------
@@ -71,83 +310,56 @@ def build_symbol_directory(symbols):
     print("[push_to_notion] 🔁 Rebuilding Symbol Directory page...")
 
     directory_id = NOTION_PARENT_PAGE
-    clear_directory(directory_id)
-
-    children = []
-
-    for code in symbols:
-        # ===== CSV 文件（不变）=====
-        csv_path = f"docs/{code}/{code}_chipzones_hybrid.csv"
-        csv_url = f"{PAGES_BASE}/{code}/{code}_chipzones_hybrid.csv"
-
-        # ===== 寻找最新 chipzones 图 =====
-        chip_pattern = f"docs/{code}/{code}_chipzones_hybrid*.png"
-        chip_path = get_latest_image(chip_pattern)
-
-        if chip_path:
-            chip_filename = os.path.basename(chip_path)
-            img_url = f"{PAGES_BASE}/{code}/{chip_filename}"
-        else:
-            img_url = None
-
-        # ===== 寻找最新 trend_v6 图 =====
-        trend_pattern = f"docs/{code}/{code}_trend_v6*.png"
-        trend_path = get_latest_image(trend_pattern)
-
-        if trend_path:
-            trend_filename = os.path.basename(trend_path)
-            trend_url = f"{PAGES_BASE}/{code}/{trend_filename}"
-        else:
-            trend_url = None
-
-        # 更新时间
-        csv_time = get_file_update_time(csv_path)
-        img_time = get_file_update_time(chip_path)
-
-        # ===== 写入内容 =====
-        children.append(safe_text_block(f"📊 {code} Analysis"))
-        children.append(safe_text_block(f"📅 Last Updated: CSV={csv_time} | IMG={img_time}", "paragraph"))
-
-        # ===== trend_v6 图 =====
-        if trend_url:
-            children.append({
-                "object": "block",
-                "type": "image",
-                "image": {"type": "external", "external": {"url": trend_url}},
-            })
-        else:
-            children.append(safe_text_block(f"⚠️ Trend_v6 image not found for {code}", "paragraph"))
-
-        # ===== chipzones 图 =====
-        if img_url:
-            children.append({
-                "object": "block",
-                "type": "image",
-                "image": {"type": "external", "external": {"url": img_url}},
-            })
-        else:
-            children.append(safe_text_block(f"⚠️ Chipzones image not found for {code}", "paragraph"))
-
-        # ===== CSV 展示（不变）=====
-        if os.path.exists(csv_path):
-            with open(csv_path, "r", encoding="utf-8-sig") as f:
-                csv_text = f.read()
-            children.append({
-                "object": "block",
-                "type": "code",
-                "code": {
-                    "language": "markdown",
-                    "rich_text": [{"type": "text", "text": {"content": csv_text[:1800]}}],
-                },
-            })
-        else:
-            children.append(safe_text_block(f"⚠️ CSV not found for {code}", "paragraph"))
-
-
-    # → 一次性推送
-    notion.blocks.children.append(directory_id, children=children)
-
-    print(f"[push_to_notion] ✅ Directory rebuilt with {len(symbols)} symbols.")
+
+    # 1) 各品种文件读取并行进行；map 保持输入顺序
+    with ThreadPoolExecutor(max_workers=min(IO_WORKERS, len(symbols)) or 1) as ex:
+        per_symbol = list(ex.map(build_symbol_blocks, symbols))
+    children = [block for blocks in per_symbol for block in blocks]
+
+    # 2) Notion API 调用留在主线程
+    # 与现有块逐个比对：相同的前缀保留，只删除/追加之后变化的部分（失败时抛出）
+    # 页面内容以远端为准：多个 workflow 写同一页面，不依赖本地缓存判断"未变化"
+    # 注意：每个品种第 2 块是按文件 mtime 生成的 "Last Updated" 行，流水线重跑或重新
+    # checkout 都会改变它，因此实际运行中通常只能保留开头的标题块，其余整页重写
+    keep = clear_directory(directory_id, children)
+
+    # → 按 100 块分批推送（必须顺序执行以保持块顺序）
+    for batch in chunked(children[keep:], APPEND_BATCH):
+        notion.blocks.children.append(directory_id, children=batch)
+
+    print(f"[push_to_notion] ✅ Directory rebuilt with {len(symbols)} symbols "
+          f"(kept {keep}, rewrote {len(children) - keep} blocks).")
+
+
+# -----------------------------
+# 解析配置 + 定位文件（一次性，main 与目录构建共用）
+# -----------------------------
+def _load_codes(config_path):
+    with open(config_path, "r", encoding="utf-8") as f:
+        config = yaml.load(f, Loader=SafeLoader)
+    raw_symbols = config.get("symbols", [])
+    return [s["code"] if isinstance(s, dict) and "code" in s else s for s in raw_symbols]
+
+
+def _resolve_symbols(codes):
+    # 目录扫描 / stat 互不依赖，线程池并行；map 保持顺序
+    with ThreadPoolExecutor(max_workers=min(IO_WORKERS, len(codes)) or 1) as ex:
+        return list(ex.map(_resolve_symbol, codes))
+
+
+def _resolve_symbol(code):
+    found = scan_symbol_dir(code)
+    csv_path, csv_mtime = found["csv"]
+    img_path, img_mtime = found["chip"]
+    trend_path, _ = found["trend"]
+    return SymRec(
+        code=code,
+        csv_path=csv_path or f"docs/{code}/{code}_chipzones_hybrid.csv",
+        img_path=img_path,
+        trend_path=trend_path,
+        csv_mtime=csv_mtime,
+        img_mtime=img_mtime,
+    )
 
 
 # -----------------------------
@@ -156,20 +368,31 @@ def build_symbol_directory(symbols):
 def main():
     print("[push_to_notion] Starting upload process...")
 
-    config_files = glob.glob("config*.yaml")
+    with os.scandir(".") as it:
+        config_files = [e.name for e in it
+                        if e.is_file() and e.name.startswith("config") and e.name.endswith(".yaml")]
     print(f"[INFO] Found config files: {config_files}")
 
-    all_symbols = []
-
+    all_codes = []
     for config_file in config_files:
         print(f"[INFO] Using config file: {config_file}")
-        with open(config_file, "r", encoding="utf-8") as f:
-            config = yaml.safe_load(f)
-        raw_symbols = config.get("symbols", [])
-        symbols = [s["code"] if isinstance(s, dict) and "code" in s else s for s in raw_symbols]
-        all_symbols.extend(symbols)
+        all_codes.extend(_load_codes(config_file))
+
+    # 多个配置文件可能包含同一品种：去重并保持首次出现的顺序
+    all_codes = list(dict.fromkeys(all_codes))
+
+    if not all_codes:
+        print("[push_to_notion] Nothing to do: no symbols configured.")
+        return
+
+    all_symbols = _resolve_symbols(all_codes)
+
+    print(f"[INFO] All symbols to include: {[rec.code for rec in all_symbols]}")
 
-    print(f"[INFO] All symbols to include: {all_symbols}")
+    # 本地一个产出都没有时不碰 Notion，保留现有目录页
+    if not any(rec.csv_mtime is not None or rec.img_path or rec.trend_path for rec in all_symbols):
+        print("[push_to_notion] Nothing to do: no chipzones/trend outputs found under docs/.")
+        return
 
     build_symbol_directory(all_symbols)
 
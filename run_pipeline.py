@@ -1,10 +1,17 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os, sys, subprocess, argparse, glob, datetime as dt, yaml, pathlib, shutil
+import os, sys, subprocess, argparse, glob, json, datetime as dt, yaml, pathlib, shutil
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml
+except ImportError:
+    from yaml import SafeLoader
 
 BASE = pathlib.Path(__file__).resolve().parent
 DOWNLOADER = str(BASE / "cn_futures_downloader.py")
 ANALYZER   = str(BASE / "asi_chipzones_plot_filtered_v3.8.2_hybrid.py")
+TREND_SCRIPT = str(BASE / "trend_oi_extreme_signedslope_dirMove_param_v6.py")
+TREND_CFG    = str(BASE / "trend_v6_config.json")
 
 def run(cmd, cwd=None):
     print("[RUN]", " ".join(map(str, cmd)), flush=True)
@@ -17,7 +24,7 @@ def run(cmd, cwd=None):
 
 def load_cfg(path):
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
 
 def ensure_dir(p): os.makedirs(p, exist_ok=True)
 
@@ -43,6 +50,15 @@ def main():
     pages_root = os.path.abspath(os.path.join(BASE, "docs"))
     ensure_dir(pages_root)
 
+    # trend v6: check script/config and parse params once per run, not per symbol
+    cfg_v6 = None
+    if os.path.exists(TREND_SCRIPT) and os.path.exists(TREND_CFG):
+        try:
+            with open(TREND_CFG, "r", encoding="utf-8") as f:
+                cfg_v6 = json.load(f)
+        except Exception as e:
+            print(f"[WARN] Failed to load {TREND_CFG}: {e}", file=sys.stderr)
+
     today = dt.date.today().strftime("%Y-%m-%d")
 
     for item in symbols:
@@ -89,18 +105,11 @@ def main():
             continue
         
         # 2.5) Trend detection (v6)
-        trend_script = os.path.join(BASE, "trend_oi_extreme_signedslope_dirMove_param_v6.py")
-        trend_cfg = os.path.join(BASE, "trend_v6_config.json")
-
-        if os.path.exists(trend_script) and os.path.exists(trend_cfg):
+        if cfg_v6 is not None:
             print(f"[INFO] Running trend detection v6 for {sym} ...", flush=True)
             try:
-                import json
-                with open(trend_cfg, "r", encoding="utf-8") as f:
-                    cfg_v6 = json.load(f)
-
                 trend_cmd = [
-                    sys.executable, trend_script,
+                    sys.executable, TREND_SCRIPT,
                     csv_in,
                     "--use_dynamic_vol",
                     "--alpha", str(cfg_v6.get("alpha", 0.382)),